@@ -6,12 +6,15 @@ Provides REST API endpoints for real-time 3D reconstruction
 
 import os
 import io
+import sys
 import json
 import time
 import asyncio
+import threading
 import requests
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, field
 from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
@@ -21,7 +24,6 @@ from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 
 # Import your VGGT model (adjust path as needed)
-import sys
 vggt_path = '/Users/siddhantsingh/Documents/GitHub/txmomentum-hackathon-2025/vggt'
 sys.path.insert(0, vggt_path)
 
@@ -52,6 +54,53 @@ except ImportError:
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:3000', 'http://localhost:5173'])
 
+# Sliding window of frames kept per session
+MAX_SESSION_FRAMES = 25
+
+# Frames are stored cropped/downscaled the way VGGT's "crop" preprocessing
+# uses them: resized to this width, with anything taller than square cropped
+MODEL_INPUT_WIDTH = 518
+
+# Removal records kept for delta responses; older tokens get a full response
+MAX_REMOVED_FRAMES = 4 * MAX_SESSION_FRAMES
+
+# Sessions idle longer than the TTL are dropped; beyond the memory budget the
+# least recently used sessions are evicted first
+SESSION_TTL_SECONDS = float(os.environ.get('VGGT_SESSION_TTL_SECONDS', 600))
+SESSION_MEMORY_BUDGET_BYTES = int(float(os.environ.get('VGGT_SESSION_MEMORY_BUDGET_MB', 1024)) * 1024 * 1024)
+
+# Voxel-grid LOD levels: grid cells along the session's scene diagonal.
+# Level 0 returns every point; higher levels use coarser voxels.
+LOD_GRID_DIVISIONS = (None, 256, 128, 64, 32)
+
+# Scene extent is measured between these per-axis percentiles so far-away
+# sky/background points cannot blow up the voxel size; at LOD > 0 points
+# further than LOD_OUTLIER_MARGIN extents outside that box are dropped
+LOD_EXTENT_PERCENTILES = (1.0, 99.0)
+LOD_OUTLIER_MARGIN = 0.5
+
+# A re-inferred frame only counts as changed for delta responses when its
+# camera or points moved by more than these tolerances (scene units), after
+# the batch has been aligned to the session's reference frame
+DELTA_POSE_TOLERANCE = 1e-3
+DELTA_POINT_TOLERANCE = 1e-2
+
+@dataclass
+class FrameReconstruction:
+    frame_id: int                      # server-assigned, unique within the session
+    frame_number: int                  # client-supplied label, may repeat
+    points: np.ndarray                 # [P, 3] float32
+    confidence: Optional[np.ndarray]   # [P] float32, None if the model gave none
+    extrinsic: np.ndarray
+    intrinsic: np.ndarray
+    pose: np.ndarray                   # raw model pose encoding, relative to its own batch
+    depth: np.ndarray
+    version: int = 0                   # session version this frame last changed at
+
+    def nbytes(self) -> int:
+        arrays = (self.points, self.confidence, self.extrinsic, self.intrinsic, self.pose, self.depth)
+        return sum(a.nbytes for a in arrays if a is not None)
+
 @dataclass
 class VGGTSession:
     session_id: str
@@ -59,13 +108,250 @@ class VGGTSession:
     frames: List[np.ndarray]
     frame_numbers: List[int] 
     last_update: float
-    reconstruction_data: Optional[Dict[str, Any]] = None
+    frame_ids: List[int] = field(default_factory=list)  # parallel to frame_numbers
+    next_frame_id: int = 0
+    last_access: float = field(default_factory=time.time)
+    result_meta: Optional[Dict[str, Any]] = None  # inference_time, image_shape, device of the last run
+    epoch: int = field(default_factory=lambda: int(time.time() * 1000))
+    version: int = 0
+    frame_results: Dict[int, FrameReconstruction] = field(default_factory=dict)  # frame_id -> result
+    removed_frames: Dict[int, int] = field(default_factory=dict)  # frame_id -> version removed at
+    scene_extent: Optional[float] = None  # robust scene diagonal, fixed at the first reconstruction
+    min_delta_version: int = 0  # tokens older than this may have missed pruned removals
+
+    # Guards frames and results; held for append/infer/update/build of one request
+    lock: threading.RLock = field(default_factory=threading.RLock, repr=False, compare=False)
+    memory_bytes: int = 0
+
+    def nbytes(self) -> int:
+        """Memory as of the last mutation; safe to read without the session lock"""
+        return self.memory_bytes
+
+    def update_nbytes(self):
+        """Re-measure frames, cached results and delta bookkeeping (call with `lock` held)"""
+        self.memory_bytes = (sum(f.nbytes for f in self.frames)
+                             + sum(r.nbytes() for r in self.frame_results.values())
+                             + sys.getsizeof(self.removed_frames)
+                             + sys.getsizeof(self.frame_ids) + sys.getsizeof(self.frame_numbers))
+
+class VGGTSessionStore:
+    """Thread-safe session map with idle TTL and LRU eviction under a memory budget"""
+
+    def __init__(self, ttl_seconds: float = SESSION_TTL_SECONDS, memory_budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self._sessions: "OrderedDict[str, VGGTSession]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            self.evict_expired()
+            return session_id in self._sessions
+
+    def __getitem__(self, session_id: str) -> VGGTSession:
+        with self._lock:
+            session = self._sessions[session_id]
+            session.last_access = time.time()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def __setitem__(self, session_id: str, session: VGGTSession):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+
+    def __delitem__(self, session_id: str):
+        with self._lock:
+            del self._sessions[session_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.evict_expired()
+            return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[VGGTSession]:
+        with self._lock:
+            self.evict_expired()
+            return self[session_id] if session_id in self._sessions else None
+
+    def get_or_create(self, session_id: str, factory) -> VGGTSession:
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = factory()
+                self[session_id] = session
+            return session
+
+    def items(self) -> List[tuple]:
+        with self._lock:
+            self.evict_expired()
+            return list(self._sessions.items())
+
+    def total_nbytes(self) -> int:
+        with self._lock:
+            return sum(s.nbytes() for s in self._sessions.values())
+
+    def evict_expired(self):
+        """Drop sessions that have not been touched within the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if s.last_access < cutoff]
+            for sid in expired:
+                del self._sessions[sid]
+                print(f"⌛ Evicted idle session: {sid}")
+
+    def enforce_budget(self, keep: Optional[str] = None):
+        """Evict least recently used sessions until the store fits the memory budget.
+
+        The session named by `keep` (the one currently being served) is never evicted.
+        """
+        with self._lock:
+            self.evict_expired()
+            total = self.total_nbytes()
+            for sid in list(self._sessions):
+                if total <= self.memory_budget_bytes:
+                    break
+                if sid == keep:
+                    continue
+                total -= self._sessions.pop(sid).nbytes()
+                print(f"🗑️ Evicted session {sid} to stay within memory budget")
+
+def format_version_token(session: VGGTSession, lod: int, confidence_percentile: float) -> str:
+    """Opaque version token handed to clients for delta requests"""
+    return f"{session.epoch}:{session.version}:{lod}:{confidence_percentile!r}"
+
+def parse_version_token(token: Optional[str], session: VGGTSession, lod: int,
+                        confidence_percentile: float) -> Optional[int]:
+    """Return the version a token refers to, or None if it is unusable for a delta"""
+    if not token:
+        return None
+    try:
+        epoch, version, token_lod, token_percentile = str(token).split(':')
+        epoch, version, token_lod = int(epoch), int(version), int(token_lod)
+        token_percentile = float(token_percentile)
+    except ValueError:
+        return None
+    # Tokens from another session instance (e.g. before a restart) or from
+    # the future cannot be diffed against, so fall back to a full response
+    if epoch != session.epoch or version > session.version or version < session.min_delta_version:
+        return None
+    # Unchanged frames on the client were filtered/downsampled with the token's
+    # settings; if those differ every frame has to be resent
+    if token_lod != lod or token_percentile != confidence_percentile:
+        return None
+    return version
+
+def filter_by_confidence(points: np.ndarray, confidence: Optional[np.ndarray], percentile: float) -> np.ndarray:
+    """Drop non-finite points and the lowest-confidence `percentile` percent"""
+    mask = np.isfinite(points).all(axis=1)
+    if confidence is not None and percentile > 0 and mask.any():
+        threshold = np.percentile(confidence[mask], percentile)
+        mask &= confidence >= threshold
+    return points[mask]
+
+def robust_bounds(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-axis percentile box of a point set, ignoring outliers"""
+    lo, hi = np.percentile(points, LOD_EXTENT_PERCENTILES, axis=0)
+    return lo, hi
+
+def robust_extent(points: np.ndarray) -> float:
+    """Diagonal of the robust bounding box; 0.0 when there are no finite points"""
+    points = points[np.isfinite(points).all(axis=1)]
+    if len(points) == 0:
+        return 0.0
+    lo, hi = robust_bounds(points)
+    return float(np.linalg.norm(hi - lo))
+
+def voxel_downsample(points: np.ndarray, lod: int, scene_extent: Optional[float]) -> np.ndarray:
+    """Replace all points falling in the same voxel with their centroid.
+
+    The voxel size comes from the session-wide `scene_extent`, so overlapping
+    frames share one resolution; outliers far outside the frame's robust box
+    are dropped rather than stretching the grid.
+    """
+    divisions = LOD_GRID_DIVISIONS[lod]
+    if divisions is None or len(points) == 0:
+        return points
+
+    lo, hi = robust_bounds(points)
+    margin = (hi - lo) * LOD_OUTLIER_MARGIN
+    points = points[((points >= lo - margin) & (points <= hi + margin)).all(axis=1)]
+
+    extent = scene_extent or float(np.linalg.norm(hi - lo))
+    if extent == 0.0 or len(points) == 0:
+        return points[:1]
+
+    voxel_size = extent / divisions
+    mins = points.min(axis=0)
+    keys = np.floor((points - mins) / voxel_size).astype(np.int64)
+    linear = np.ravel_multi_index(keys.T, keys.max(axis=0) + 1)
+    _, inverse, counts = np.unique(linear, return_inverse=True, return_counts=True)
+
+    centroids = np.empty((len(counts), 3), dtype=np.float32)
+    for axis in range(3):
+        centroids[:, axis] = np.bincount(inverse, weights=points[:, axis], minlength=len(counts)) / counts
+    return centroids
+
+def frame_changed(old: FrameReconstruction, new: FrameReconstruction) -> bool:
+    """Whether a re-inferred frame differs enough to resend it to clients"""
+    if old.points.shape != new.points.shape:
+        return True
+    if np.abs(old.extrinsic - new.extrinsic).max() > DELTA_POSE_TOLERANCE:
+        return True
+    if np.abs(old.intrinsic - new.intrinsic).max() > DELTA_POSE_TOLERANCE:
+        return True
+    displacement = np.nanmean(np.abs(old.points - new.points)) if old.points.size else 0.0
+    return bool(displacement > DELTA_POINT_TOLERANCE)
+
+def split_extrinsic(extrinsic: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(R, t) from a flattened 3x4 or 4x4 world-to-camera matrix"""
+    m = extrinsic.reshape(-1, 4)[:3].astype(np.float64)
+    return m[:, :3], m[:, 3]
+
+def join_extrinsic(rotation: np.ndarray, translation: np.ndarray, like: np.ndarray) -> np.ndarray:
+    """Flatten (R, t) back into the layout of `like` (3x4 or 4x4)"""
+    m = np.eye(4)
+    m[:3, :3] = rotation
+    m[:3, 3] = translation
+    return m[:like.size // 4].flatten().astype(like.dtype)
+
+def align_to_anchor(anchor: FrameReconstruction, anchor_new: FrameReconstruction,
+                    frames: List[FrameReconstruction]):
+    """Move a batch's results into the session's reference frame, in place.
+
+    VGGT puts the world origin at the first camera of each batch (and picks
+    its own scale), so once the window slides every coordinate shifts even
+    though the scene did not. `anchor` is a frame as clients already hold it,
+    `anchor_new` the same frame from this batch; the similarity transform
+    mapping one onto the other is applied to every frame of the batch.
+    """
+    r_old, t_old = split_extrinsic(anchor.extrinsic)
+    r_new, t_new = split_extrinsic(anchor_new.extrinsic)
+
+    # Scale from the anchor's points measured in its own camera frame
+    cam_old = np.linalg.norm(anchor.points @ r_old.T + t_old, axis=1)
+    cam_new = np.linalg.norm(anchor_new.points @ r_new.T + t_new, axis=1)
+    valid = np.isfinite(cam_old) & np.isfinite(cam_new) & (cam_new > 0)
+    scale = float(np.median(cam_old[valid]) / np.median(cam_new[valid])) if valid.any() else 1.0
+    if not np.isfinite(scale) or scale <= 0:
+        scale = 1.0
+
+    # batch world -> session world: x_s = R_o^T (s (R_n x_b + t_n) - t_o)
+    rotation = r_old.T @ r_new
+    translation = r_old.T @ (scale * t_new - t_old)
+    for frame in frames:
+        frame.points = (scale * frame.points @ rotation.T + translation).astype(np.float32)
+        r_i, t_i = split_extrinsic(frame.extrinsic)
+        frame.extrinsic = join_extrinsic(r_i @ r_new.T @ r_old,
+                                         r_i @ r_new.T @ (t_old - scale * t_new) + scale * t_i,
+                                         frame.extrinsic)
+        frame.depth = (frame.depth * scale).astype(np.float32)
 
 class VGGTServerProxy:
     def __init__(self):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         self.model: Optional[VGGT] = None
-        self.sessions: Dict[str, VGGTSession] = {}
+        self.sessions = VGGTSessionStore()
         self.executor = ThreadPoolExecutor(max_workers=2)
         
         print(f"🔬 VGGT Server Proxy initialized on device: {self.device}")
@@ -87,7 +373,7 @@ class VGGTServerProxy:
                 raise
 
     async def download_image(self, url: str) -> Optional[np.ndarray]:
-        """Download image from URL"""
+        """Download image from URL, cropped/downscaled to model input size as uint8 RGB"""
         try:
             response = requests.get(url, timeout=10)
             response.raise_for_status()
@@ -95,13 +381,64 @@ class VGGTServerProxy:
             image = Image.open(io.BytesIO(response.content))
             if image.mode != 'RGB':
                 image = image.convert('RGB')
+
+            # No point keeping more pixels than preprocessing will feed the model:
+            # it center-crops anything taller than square, then scales to 518 wide
+            if image.height > image.width:
+                top = (image.height - image.width) // 2
+                image = image.crop((0, top, image.width, top + image.width))
+            if image.width > MODEL_INPUT_WIDTH:
+                height = max(1, round(image.height * MODEL_INPUT_WIDTH / image.width))
+                image = image.resize((MODEL_INPUT_WIDTH, height), Image.BICUBIC)
                 
-            return np.array(image)
+            return np.asarray(image, dtype=np.uint8)
         except Exception as e:
             print(f"❌ Failed to download image {url}: {e}")
             return None
 
-    async def process_reconstruction(self, session_id: str, image_urls: List[str], frame_numbers: List[int]) -> Dict[str, Any]:
+    def get_or_create_session(self, session_id: str) -> VGGTSession:
+        """Get or create a session"""
+        return self.sessions.get_or_create(session_id, lambda: VGGTSession(
+            session_id=session_id,
+            model=self.model,
+            frames=[],
+            frame_numbers=[],
+            last_update=time.time()
+        ))
+
+    def append_frames(self, session: VGGTSession, frame_numbers: List[int],
+                      images: Optional[List[np.ndarray]] = None) -> List[int]:
+        """Add frames to the session window, assigning each a unique frame id"""
+        frame_ids = list(range(session.next_frame_id, session.next_frame_id + len(frame_numbers)))
+        session.next_frame_id += len(frame_numbers)
+
+        session.frame_ids.extend(frame_ids)
+        session.frame_numbers.extend(frame_numbers)
+        if images is not None:
+            session.frames.extend(images)
+        session.last_update = time.time()
+
+        # Keep only recent frames (last 25 frames max for performance)
+        session.frame_ids = session.frame_ids[-MAX_SESSION_FRAMES:]
+        session.frame_numbers = session.frame_numbers[-MAX_SESSION_FRAMES:]
+        session.frames = session.frames[-MAX_SESSION_FRAMES:]
+        session.update_nbytes()
+        return frame_ids
+
+    def get_session_result(self, session_id: str, lod: int = 0, confidence_percentile: float = 0.0,
+                           since_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Rebuild a session's latest reconstruction from its cached arrays"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        with session.lock:
+            if session.result_meta is None:
+                return None
+            return self.build_response(session, lod, confidence_percentile, since_version, session.result_meta)
+
+    async def process_reconstruction(self, session_id: str, image_urls: List[str], frame_numbers: List[int],
+                                     lod: int = 0, confidence_percentile: float = 0.0,
+                                     since_version: Optional[str] = None) -> Dict[str, Any]:
         """Process images with VGGT model"""
         try:
             self.load_model()
@@ -109,7 +446,22 @@ class VGGTServerProxy:
             # If VGGT is not available, return mock data
             if not VGGT_AVAILABLE:
                 print(f"🎭 Generating mock reconstruction data for {len(image_urls)} images")
-                return self._generate_mock_reconstruction(session_id, image_urls, frame_numbers)
+                session = self.get_or_create_session(session_id)
+                with session.lock:
+                    new_frame_numbers = frame_numbers[:len(image_urls)]
+                    new_frame_ids = self.append_frames(session, new_frame_numbers)
+
+                    frame_results = self._generate_mock_reconstruction(new_frame_ids, new_frame_numbers)
+                    self.update_frame_results(session, frame_results)
+                    session.result_meta = {
+                        'inference_time': 0.5,
+                        'image_shape': [224, 224],
+                        'device': 'mock',
+                        'mock_data': True
+                    }
+                    result = self.build_response(session, lod, confidence_percentile, since_version, session.result_meta)
+                self.sessions.enforce_budget(keep=session_id)
+                return result
             
             # Download all images
             print(f"📥 Downloading {len(image_urls)} images for session {session_id}")
@@ -129,125 +481,211 @@ class VGGTServerProxy:
             
             print(f"✅ Downloaded {len(valid_images)} valid images")
             
-            # Get or create session
-            if session_id not in self.sessions:
-                self.sessions[session_id] = VGGTSession(
-                    session_id=session_id,
-                    model=self.model,
-                    frames=[],
-                    frame_numbers=[],
-                    last_update=time.time()
-                )
+            session = self.get_or_create_session(session_id)
             
-            session = self.sessions[session_id]
+            # One reconstruction per session at a time; the store lock is never taken
+            # while holding a session lock, so budget enforcement happens after release
+            with session.lock:
+                # Add new frames to session
+                self.append_frames(session, valid_frame_numbers, valid_images)
             
-            # Add new frames to session
-            session.frames.extend(valid_images)
-            session.frame_numbers.extend(valid_frame_numbers)
-            session.last_update = time.time()
+                print(f"🔬 Processing {len(session.frames)} total frames for session {session_id}")
             
-            # Keep only recent frames (last 25 frames max for performance)
-            if len(session.frames) > 25:
-                session.frames = session.frames[-25:]
-                session.frame_numbers = session.frame_numbers[-25:]
+                # Preprocess images for VGGT
+                images_tensor = preprocess_images(session.frames).to(self.device)
+                print(f"📊 Preprocessed images shape: {images_tensor.shape}")
             
-            print(f"🔬 Processing {len(session.frames)} total frames for session {session_id}")
-            
-            # Preprocess images for VGGT
-            images_tensor = preprocess_images(session.frames).to(self.device)
-            print(f"📊 Preprocessed images shape: {images_tensor.shape}")
-            
-            # Run VGGT inference
-            with torch.no_grad():
-                print("🧠 Running VGGT inference...")
-                start_time = time.time()
+                # Run VGGT inference
+                with torch.no_grad():
+                    print("🧠 Running VGGT inference...")
+                    start_time = time.time()
                 
-                outputs = self.model(images_tensor)
+                    outputs = self.model(images_tensor)
                 
-                inference_time = time.time() - start_time
-                print(f"⚡ VGGT inference completed in {inference_time:.2f}s")
+                    inference_time = time.time() - start_time
+                    print(f"⚡ VGGT inference completed in {inference_time:.2f}s")
                 
-                # Extract outputs
-                pose_encoding = outputs['poses']  # [N, pose_dim]
-                depth_maps = outputs['depths']    # [N, H, W]
-                point_clouds = outputs['points']  # [N, num_points, 3]
+                    # Extract outputs
+                    pose_encoding = outputs['poses']  # [N, pose_dim]
+                    depth_maps = outputs['depths']    # [N, H, W]
+                    point_clouds = outputs['points']  # [N, num_points, 3]
+                    point_conf = outputs.get('world_points_conf')  # [N, num_points], optional
                 
-                # Convert poses to camera matrices
-                extrinsic_matrices, intrinsic_matrices = convert_poses_to_cameras(pose_encoding)
+                    # Convert poses to camera matrices
+                    extrinsic_matrices, intrinsic_matrices = convert_poses_to_cameras(pose_encoding)
                 
-                # Convert to numpy and flatten for JSON serialization
-                result = {
-                    'session_id': session_id,
-                    'frame_count': len(session.frames),
-                    'frame_numbers': session.frame_numbers,
-                    'poses': pose_encoding.cpu().numpy().flatten().tolist(),
-                    'depths': depth_maps.cpu().numpy().flatten().tolist(),
-                    'points_3d': point_clouds.cpu().numpy().flatten().tolist(),
-                    'cameras': [
-                        {
-                            'extrinsic': ext.flatten().tolist(),
-                            'intrinsic': intr.flatten().tolist()
-                        }
-                        for ext, intr in zip(extrinsic_matrices, intrinsic_matrices)
-                    ],
+                # Cache results as compact float32 arrays; JSON lists are only built per response
+                num_frames = len(session.frames)
+                poses = pose_encoding.cpu().numpy().reshape(num_frames, -1).astype(np.float32)
+                depths = depth_maps.cpu().numpy().reshape(num_frames, -1).astype(np.float32)
+                points = point_clouds.cpu().numpy().reshape(num_frames, -1, 3).astype(np.float32)
+                conf = point_conf.cpu().numpy().reshape(num_frames, -1).astype(np.float32) if point_conf is not None else None
+
+                frame_results = [
+                    FrameReconstruction(
+                        frame_id=frame_id,
+                        frame_number=frame_num,
+                        # Copies, not views: a kept frame must not pin the whole batch in memory
+                        points=points[i].copy(),
+                        confidence=conf[i].copy() if conf is not None else None,
+                        extrinsic=np.asarray(extrinsic_matrices[i], dtype=np.float32).flatten(),
+                        intrinsic=np.asarray(intrinsic_matrices[i], dtype=np.float32).flatten(),
+                        pose=poses[i].copy(),
+                        depth=depths[i].copy()
+                    )
+                    for i, (frame_id, frame_num) in enumerate(zip(session.frame_ids, session.frame_numbers))
+                ]
+                self.update_frame_results(session, frame_results)
+
+                session.result_meta = {
                     'inference_time': inference_time,
-                    'timestamp': time.time(),
-                    'image_shape': images_tensor.shape[2:],  # [H, W]
+                    'image_shape': list(images_tensor.shape[2:]),  # [H, W]
                     'device': str(self.device)
                 }
-                
-                # Cache result in session
-                session.reconstruction_data = result
-                
-                print(f"✅ VGGT reconstruction completed: {len(session.frames)} frames, {inference_time:.2f}s")
-                return result
+                result = self.build_response(session, lod, confidence_percentile, since_version, session.result_meta)
+            self.sessions.enforce_budget(keep=session_id)
+            
+            print(f"✅ VGGT reconstruction completed: {num_frames} frames, {inference_time:.2f}s")
+            return result
                 
         except Exception as e:
             print(f"❌ VGGT reconstruction failed: {e}")
             raise
 
-    def _generate_mock_reconstruction(self, session_id: str, image_urls: List[str], frame_numbers: List[int]) -> Dict[str, Any]:
+    def update_frame_results(self, session: VGGTSession, frame_results: List[FrameReconstruction]):
+        """Store per-frame results and bump the session version for frames that changed"""
+        session.version += 1
+
+        # Re-express the batch in the session's reference frame before comparing,
+        # anchored on the oldest frame clients already have
+        new_by_id = {frame.frame_id: frame for frame in frame_results}
+        anchor_id = next((i for i in session.frame_ids if i in new_by_id and i in session.frame_results), None)
+        if anchor_id is not None:
+            align_to_anchor(session.frame_results[anchor_id], new_by_id[anchor_id], frame_results)
+
+        if session.scene_extent is None:
+            session.scene_extent = robust_extent(np.concatenate([f.points for f in frame_results])) or None
+
+        for frame in frame_results:
+            previous = session.frame_results.get(frame.frame_id)
+            if previous is not None and not frame_changed(previous, frame):
+                # Keep exactly what clients were last sent, so small changes are
+                # measured against it and cannot accumulate unseen
+                continue
+            frame.version = session.version
+            session.frame_results[frame.frame_id] = frame
+
+        # Frames that slid out of the window are reported as removed in deltas
+        window = set(session.frame_ids)
+        for frame_id in list(session.frame_results):
+            if frame_id not in window:
+                del session.frame_results[frame_id]
+                session.removed_frames[frame_id] = session.version
+
+        # Bound the removal log; tokens from before the oldest dropped record
+        # can no longer be diffed and fall back to a full response
+        if len(session.removed_frames) > MAX_REMOVED_FRAMES:
+            by_version = sorted(session.removed_frames.items(), key=lambda item: item[1])
+            for frame_id, version in by_version[:len(by_version) - MAX_REMOVED_FRAMES]:
+                del session.removed_frames[frame_id]
+                session.min_delta_version = max(session.min_delta_version, version)
+
+        session.update_nbytes()
+
+    def build_response(self, session: VGGTSession, lod: int, confidence_percentile: float,
+                       since_version: Optional[str], extra: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a (possibly delta) reconstruction response from the session's frame results"""
+        since = parse_version_token(since_version, session, lod, confidence_percentile)
+        is_delta = since is not None
+
+        frames = [session.frame_results[i] for i in session.frame_ids if i in session.frame_results]
+        updated = [f for f in frames if not is_delta or f.version > since]
+        removed = sorted(i for i, v in session.removed_frames.items() if is_delta and v > since)
+
+        point_chunks = []
+        point_counts = []
+        total_points = 0
+        for frame in updated:
+            total_points += len(frame.points)
+            points = filter_by_confidence(frame.points, frame.confidence, confidence_percentile)
+            points = voxel_downsample(points, lod, session.scene_extent)
+            point_chunks.append(points)
+            point_counts.append(len(points))
+
+        points_3d = np.concatenate(point_chunks) if point_chunks else np.empty((0, 3), dtype=np.float32)
+
+        result = {
+            'session_id': session.session_id,
+            'frame_count': len(frames),
+            'frame_ids': [f.frame_id for f in frames],
+            'frame_numbers': [f.frame_number for f in frames],
+            'version': format_version_token(session, lod, confidence_percentile),
+            'delta': is_delta,
+            'updated_frame_ids': [f.frame_id for f in updated],
+            'updated_frame_numbers': [f.frame_number for f in updated],
+            'removed_frame_ids': removed,
+            'lod': lod,
+            'confidence_percentile': confidence_percentile,
+            # False when the model gave no confidence, in which case the percentile is not applied
+            'confidence_available': all(f.confidence is not None for f in frames),
+            'poses': np.concatenate([f.pose for f in updated]).tolist() if updated else [],
+            'depths': np.concatenate([f.depth for f in updated]).tolist() if updated else [],
+            'points_3d': points_3d.flatten().tolist(),
+            'point_counts': point_counts,
+            'total_points': total_points,
+            'cameras': [
+                {
+                    'frame_id': f.frame_id,
+                    'frame_number': f.frame_number,
+                    'extrinsic': f.extrinsic.tolist(),
+                    'intrinsic': f.intrinsic.tolist()
+                }
+                for f in updated
+            ],
+            'timestamp': time.time()
+        }
+        result.update(extra)
+        return result
+
+    def _generate_mock_reconstruction(self, frame_ids: List[int], frame_numbers: List[int]) -> List[FrameReconstruction]:
         """Generate mock reconstruction data for testing"""
-        import time
         time.sleep(0.5)  # Simulate processing time
         
-        num_frames = len(image_urls)
-        
         # Generate mock data with realistic dimensions
-        mock_poses = np.random.randn(num_frames, 12).flatten()  # 12D pose encoding
-        mock_depths = np.random.rand(num_frames, 224, 224).flatten()  # Mock depth maps
-        mock_points = np.random.randn(num_frames, 1000, 3).flatten()  # Mock 3D points
-        
-        # Mock camera matrices
-        mock_cameras = []
-        for i in range(num_frames):
-            extrinsic = np.eye(4).flatten()  # Identity matrix as mock extrinsic
-            intrinsic = np.array([[520, 0, 320], [0, 520, 240], [0, 0, 1]]).flatten()  # Mock intrinsic
-            mock_cameras.append({
-                'extrinsic': extrinsic.tolist(),
-                'intrinsic': intrinsic.tolist()
-            })
-        
-        result = {
-            'session_id': session_id,
-            'frame_count': num_frames,
-            'frame_numbers': frame_numbers,
-            'poses': mock_poses.tolist(),
-            'depths': mock_depths.tolist(),
-            'points_3d': mock_points.tolist(),
-            'cameras': mock_cameras,
-            'inference_time': 0.5,
-            'timestamp': time.time(),
-            'image_shape': [224, 224],
-            'device': 'mock',
-            'mock_data': True
-        }
+        frame_results = []
+        for frame_id, frame_num in zip(frame_ids, frame_numbers):
+            extrinsic = np.eye(4, dtype=np.float32).flatten()  # Identity matrix as mock extrinsic
+            intrinsic = np.array([[520, 0, 320], [0, 520, 240], [0, 0, 1]], dtype=np.float32).flatten()  # Mock intrinsic
+            frame_results.append(FrameReconstruction(
+                frame_id=frame_id,
+                frame_number=frame_num,
+                points=np.random.randn(1000, 3).astype(np.float32),  # Mock 3D points
+                confidence=1.0 + np.random.rand(1000).astype(np.float32),  # Mock confidence
+                extrinsic=extrinsic,
+                intrinsic=intrinsic,
+                pose=np.random.randn(12).astype(np.float32),  # 12D pose encoding
+                depth=np.random.rand(224 * 224).astype(np.float32)  # Mock depth map
+            ))
         
-        return result
+        return frame_results
 
 # Global instance
 proxy = VGGTServerProxy()
 
+def parse_lod_params(params) -> tuple:
+    """Read and validate lod / confidence_percentile from a request's JSON or query args"""
+    try:
+        lod = int(params.get('lod', 0))
+        confidence_percentile = float(params.get('confidence_percentile', 0.0))
+    except (TypeError, ValueError):
+        raise ValueError('lod must be an integer and confidence_percentile a number')
+
+    if not 0 <= lod < len(LOD_GRID_DIVISIONS):
+        raise ValueError(f'lod must be between 0 and {len(LOD_GRID_DIVISIONS) - 1}')
+    if not 0.0 <= confidence_percentile < 100.0:
+        raise ValueError('confidence_percentile must be in [0, 100)')
+    return lod, confidence_percentile
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -257,13 +695,21 @@ def health_check():
         'vggt_available': VGGT_AVAILABLE,
         'model_loaded': proxy.model is not None,
         'active_sessions': len(proxy.sessions),
+        'session_memory_bytes': proxy.sessions.total_nbytes(),
         'mode': 'production' if VGGT_AVAILABLE else 'mock',
         'timestamp': time.time()
     })
 
 @app.route('/api/reconstruct', methods=['POST'])
 def reconstruct():
-    """Main reconstruction endpoint"""
+    """Main reconstruction endpoint
+
+    Optional JSON fields:
+      lod                   - voxel-grid level of detail, 0 (all points) to len(LOD_GRID_DIVISIONS) - 1
+      confidence_percentile - drop the lowest-confidence percentage of each frame's points
+      since_version         - `version` token from an earlier response; only changed frames are returned.
+                              Frames are identified by the server-assigned `frame_ids`.
+    """
     try:
         data = request.get_json()
         
@@ -273,9 +719,15 @@ def reconstruct():
         image_urls = data.get('images', [])
         session_id = data.get('session_id', f'session_{int(time.time())}')
         frame_numbers = data.get('frame_numbers', list(range(len(image_urls))))
+        since_version = data.get('since_version')
         
         if not image_urls:
             return jsonify({'error': 'No images provided'}), 400
+
+        try:
+            lod, confidence_percentile = parse_lod_params(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
             
         print(f"🔬 Reconstruction request: {len(image_urls)} images for session {session_id}")
         
@@ -285,7 +737,8 @@ def reconstruct():
         
         try:
             result = loop.run_until_complete(
-                proxy.process_reconstruction(session_id, image_urls, frame_numbers)
+                proxy.process_reconstruction(session_id, image_urls, frame_numbers,
+                                             lod, confidence_percentile, since_version)
             )
             return jsonify(result)
         finally:
@@ -297,17 +750,27 @@ def reconstruct():
 
 @app.route('/api/sessions/<session_id>', methods=['GET'])
 def get_session_data(session_id):
-    """Get cached reconstruction data for a session"""
+    """Get cached reconstruction data for a session
+
+    Accepts the same lod / confidence_percentile / since_version options as
+    /api/reconstruct as query parameters.
+    """
     try:
         if session_id not in proxy.sessions:
             return jsonify({'error': 'Session not found'}), 404
+
+        try:
+            lod, confidence_percentile = parse_lod_params(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
             
-        session = proxy.sessions[session_id]
+        result = proxy.get_session_result(session_id, lod, confidence_percentile,
+                                          request.args.get('since_version'))
         
-        if session.reconstruction_data is None:
+        if result is None:
             return jsonify({'error': 'No reconstruction data available'}), 404
             
-        return jsonify(session.reconstruction_data)
+        return jsonify(result)
         
     except Exception as e:
         print(f"❌ Session data error: {e}")
@@ -322,15 +785,20 @@ def list_sessions():
         
         for session_id, session in proxy.sessions.items():
             session_info[session_id] = {
-                'frame_count': len(session.frames),
+                'frame_count': len(session.frame_numbers),
                 'last_update': session.last_update,
                 'age_seconds': current_time - session.last_update,
-                'has_reconstruction': session.reconstruction_data is not None
+                'idle_seconds': current_time - session.last_access,
+                'has_reconstruction': session.result_meta is not None,
+                'memory_bytes': session.nbytes()
             }
             
         return jsonify({
-            'active_sessions': len(proxy.sessions),
-            'sessions': session_info
+            'active_sessions': len(session_info),
+            'sessions': session_info,
+            'total_memory_bytes': sum(info['memory_bytes'] for info in session_info.values()),
+            'memory_budget_bytes': proxy.sessions.memory_budget_bytes,
+            'session_ttl_seconds': proxy.sessions.ttl_seconds
         })
         
     except Exception as e:
@@ -362,5 +830,7 @@ if __name__ == '__main__':
     print("  - GET  /api/sessions")
     print("  - GET  /api/sessions/<session_id>")
     print("  - DELETE /api/sessions/<session_id>")
+    print(f"🧹 Sessions expire after {SESSION_TTL_SECONDS:.0f}s idle, "
+          f"memory budget {SESSION_MEMORY_BUDGET_BYTES / (1024 * 1024):.0f} MB")
     
     app.run(host='0.0.0.0', port=8081, debug=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,311 @@
+# batch_infer.py
+# Offline batch processing of recorded media (same pipeline as /v1/infer).
+#
+#   python batch_infer.py /path/to/recordings --output results.jsonl
+#   python batch_infer.py manifest.txt --output results.jsonl --workers 16 --batch-size 32
+#
+# Decoding runs in a process pool; ASR, captioning and the LLM run in batches in
+# the main process. Results are appended to the JSONL output as each batch
+# finishes, and rerunning the same command skips paths already in the output.
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Set
+
+import cv2
+import numpy as np
+import torch
+
+# Local modules
+from preprocess_audio import AudioProcessor, load_audio_file, load_audio_ffmpeg
+from preprocess_video import VideoProcessor, read_frames, resize_frame
+from model_interface import ModelInterface
+
+MEDIA_EXTENSIONS = {".wav", ".flac", ".ogg", ".mp3", ".m4a", ".mp4", ".mov", ".mkv", ".avi", ".webm"}
+TARGET_SR = 16000
+TARGET_FPS = 1
+# long recordings are transcribed as fixed-length chunks so they batch evenly
+ASR_CHUNK_SECONDS = 30
+ASR_BATCH_SIZE = 8
+# decoded float32 audio is ~230 MB per recorded hour; stop queueing decodes past this much
+MAX_QUEUED_AUDIO_BYTES = 2 * 1024 ** 3
+
+
+def discover_inputs(source: str) -> List[str]:
+    # a directory (searched recursively) or a manifest: one path per line, or JSONL with a "path" key
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS:
+                    paths.append(os.path.abspath(os.path.join(root, name)))
+        return sorted(paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(os.path.abspath(os.path.join(base, path)))
+    return paths
+
+
+def load_checkpoint(output_path: str, retry_errors: bool) -> Set[str]:
+    # the output file is the checkpoint: every path with a record in it is done
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        # drop a partially written last line left by an interrupted run
+        if data and not data.endswith(b"\n"):
+            data = data[:data.rfind(b"\n") + 1]
+            f.truncate(len(data))
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if retry_errors and "error" in record:
+            continue
+        done.add(record["path"])
+    return done
+
+
+def init_worker():
+    # one thread per decode process; the pool itself provides the parallelism
+    cv2.setNumThreads(1)
+    torch.set_num_threads(1)
+
+
+def decode_audio(path: str):
+    # libsndfile for plain audio files, ffmpeg for everything else (m4a, video containers)
+    try:
+        audio = load_audio_file(path, TARGET_SR)
+        return audio.mean(axis=1) if audio.ndim > 1 else audio
+    except Exception:
+        return load_audio_ffmpeg(path, TARGET_SR)
+
+
+def audio_bytes(item: Dict) -> int:
+    return item["audio"].nbytes if item.get("audio") is not None else 0
+
+
+def decode_media(path: str, max_frames: int, frame_size) -> Dict:
+    # runs in a worker process: CPU-bound decoding only, no models loaded.
+    # frames are resized to the captioner's input size here so only small arrays cross the process boundary
+    item = {"path": path, "audio": None, "frames": None}
+    try:
+        item["audio"] = decode_audio(path)
+    except Exception as e:
+        # the file has (or may have) audio we could not read: don't record it as done with an empty transcript
+        stderr = getattr(e, "stderr", None)
+        detail = stderr.decode(errors="replace").strip()[-300:] if stderr else str(e)
+        item["error"] = f"audio decode failed: {detail}"
+        return item
+    try:
+        item["frames"] = [resize_frame(f, frame_size) for f in read_frames(path, TARGET_FPS, max_frames)] or None
+    except Exception:
+        pass
+    if item["audio"] is None and item["frames"] is None:
+        item["error"] = "could not decode audio or video"
+    return item
+
+
+def decode_isolated(ctx, path: str, max_frames: int, frame_size) -> Dict:
+    # re-decode one file in its own process, to find which file took the shared pool down
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx, initializer=init_worker) as solo:
+        try:
+            return solo.submit(decode_media, path, max_frames, frame_size).result()
+        except BrokenProcessPool:
+            return {"path": path, "audio": None, "frames": None, "error": "decoder process crashed"}
+
+
+async def transcribe_all(audio_proc: AudioProcessor, audios: List[np.ndarray]) -> List[str]:
+    # split every clip into ASR_CHUNK_SECONDS pieces and run them through the model in batches
+    chunk_len = ASR_CHUNK_SECONDS * TARGET_SR
+    chunks, owners = [], []
+    for i, audio in enumerate(audios):
+        for start in range(0, len(audio), chunk_len):
+            # a sliver left over at the end is too short for the conv feature extractor
+            if start > 0 and len(audio) - start < TARGET_SR // 10:
+                break
+            chunks.append(torch.from_numpy(np.ascontiguousarray(audio[start:start + chunk_len])))
+            owners.append(i)
+    texts = []
+    for i in range(0, len(chunks), ASR_BATCH_SIZE):
+        texts.extend(await audio_proc.transcribe_batch(chunks[i:i + ASR_BATCH_SIZE]))
+    transcripts = [[] for _ in audios]
+    for owner, text in zip(owners, texts):
+        if text.strip():
+            transcripts[owner].append(text.strip())
+    return [" ".join(t) for t in transcripts]
+
+
+async def infer_batch(items: List[Dict], audio_proc: AudioProcessor, video_proc: VideoProcessor,
+                      model_if: ModelInterface, task: str) -> List[Dict]:
+    with_audio = [i for i, item in enumerate(items) if item["audio"] is not None and len(item["audio"])]
+    transcripts = [""] * len(items)
+    for i, text in zip(with_audio, await transcribe_all(audio_proc, [items[i]["audio"] for i in with_audio])):
+        transcripts[i] = text
+
+    # caption every frame of the batch in one pass, then hand captions back per item
+    all_frames = [f for item in items for f in (item["frames"] or [])]
+    all_captions = await video_proc.caption_frames(all_frames) if all_frames else []
+    captions, pos = [], 0
+    for item in items:
+        n = len(item["frames"] or [])
+        captions.append(all_captions[pos:pos + n])
+        pos += n
+
+    prompts = [model_if.compose_prompt(task=task, transcript=t, captions=c) for t, c in zip(transcripts, captions)]
+    outputs = await model_if.generate_many(prompts)
+    return [
+        {"path": item["path"], "task": task, "result": out, "transcript": t, "captions": c, "processed_at": time.time()}
+        for item, t, c, out in zip(items, transcripts, captions, outputs)
+    ]
+
+
+async def infer_or_isolate(items, audio_proc, video_proc, model_if, task) -> List[Dict]:
+    # if a batch fails, retry item by item so one bad file only costs itself
+    try:
+        return await infer_batch(items, audio_proc, video_proc, model_if, task)
+    except Exception as e:
+        if len(items) == 1:
+            return [{"path": items[0]["path"], "error": f"inference failed: {e}"}]
+    records = []
+    for item in items:
+        try:
+            records.extend(await infer_batch([item], audio_proc, video_proc, model_if, task))
+        except Exception as e:
+            records.append({"path": item["path"], "error": f"inference failed: {e}"})
+    return records
+
+
+def run(args):
+    paths = discover_inputs(args.input)
+    done = load_checkpoint(args.output, args.retry_errors)
+    todo = [p for p in paths if p not in done]
+    print(f"{len(paths)} inputs, {len(paths) - len(todo)} already in {args.output}, {len(todo)} to process")
+    if not todo:
+        return
+
+    if shutil.which("ffmpeg") is None:
+        raise SystemExit("ffmpeg not found on PATH; it is needed to read audio from m4a and video files")
+
+    torch.set_num_threads(args.inference_threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    audio_proc = AudioProcessor(target_sr=TARGET_SR)
+    video_proc = VideoProcessor(target_fps=TARGET_FPS)
+    model_if = ModelInterface(device=device, max_batch_size=args.batch_size)
+    loop = asyncio.new_event_loop()
+
+    # keep enough decodes queued that the pool stays busy while a batch is on the models
+    max_in_flight = max(args.workers * 2, args.batch_size)
+    pending = iter(todo)
+    in_flight = {}  # future -> path
+    ready = []
+    processed = 0
+    t0 = time.time()
+
+    # spawn, not fork: the parent already holds model weights and torch thread pools
+    ctx = mp.get_context("spawn")
+    new_pool = lambda: ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx, initializer=init_worker)
+    pool = new_pool()
+    with open(args.output, "a", encoding="utf-8") as out:
+
+        def queued_audio_full() -> bool:
+            # long recordings make item count a poor bound on memory, so also cap decoded audio waiting for the models
+            return sum(audio_bytes(item) for item in ready) >= MAX_QUEUED_AUDIO_BYTES
+
+        def submit_more():
+            while len(in_flight) < max_in_flight and not queued_audio_full():
+                path = next(pending, None)
+                if path is None:
+                    break
+                in_flight[pool.submit(decode_media, path, args.max_frames, video_proc.frame_size)] = path
+
+        submit_more()
+        while in_flight or ready:
+            if in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                crashed = []
+                for fut in finished:
+                    path = in_flight.pop(fut)
+                    try:
+                        ready.append(fut.result())
+                    except BrokenProcessPool:
+                        crashed.append(path)
+                if crashed:
+                    # a decoder died (e.g. segfault on a corrupt file) and took every in-flight
+                    # decode with it; retry each of those alone so only the culprit gets an error
+                    crashed.extend(in_flight.values())
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    print(f"decode pool crashed, re-checking {len(crashed)} files one by one")
+                    ready.extend(decode_isolated(ctx, p, args.max_frames, video_proc.frame_size) for p in crashed)
+                    pool = new_pool()
+                submit_more()
+            if len(ready) < args.batch_size and in_flight and not queued_audio_full():
+                continue
+
+            # cut the batch early if its audio alone would exceed the queue budget
+            size, total = 0, 0
+            while size < min(args.batch_size, len(ready)) and (size == 0 or total < MAX_QUEUED_AUDIO_BYTES):
+                total += audio_bytes(ready[size])
+                size += 1
+            batch, ready = ready[:size], ready[size:]
+            records = [{"path": item["path"], "error": item["error"]} for item in batch if "error" in item]
+            decodable = [item for item in batch if "error" not in item]
+            if decodable:
+                with torch.inference_mode():
+                    records.extend(loop.run_until_complete(
+                        infer_or_isolate(decodable, audio_proc, video_proc, model_if, args.task)))
+
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+            processed += len(records)
+            rate = processed / (time.time() - t0)
+            print(f"{processed}/{len(todo)} done ({rate:.2f} files/s)")
+
+    pool.shutdown()
+    loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch inference over recorded audio/video files")
+    parser.add_argument("input", help="directory of media files, or a manifest (one path per line or JSONL with 'path')")
+    parser.add_argument("--output", "-o", default="results.jsonl", help="JSONL results file, also used to resume")
+    parser.add_argument("--task", default="summarize")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="decode processes (default: a quarter of the cores)")
+    parser.add_argument("--inference-threads", type=int, default=None,
+                        help="torch threads for the models (default: the cores not used for decoding)")
+    parser.add_argument("--batch-size", type=int, default=32, help="files per model batch")
+    parser.add_argument("--max-frames", type=int, default=8, help="frames captioned per video")
+    parser.add_argument("--retry-errors", action="store_true", help="reprocess files recorded with an error")
+    args = parser.parse_args()
+    # decoding is a small share of the work next to ASR, captioning and the LLM: a small
+    # decode pool keeps up, and the models get the rest of the cores
+    cores = os.cpu_count() or 1
+    if args.workers is None:
+        args.workers = max(1, cores // 4)
+    if args.inference_threads is None:
+        args.inference_threads = max(1, cores - args.workers)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
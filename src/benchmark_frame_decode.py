@@ -0,0 +1,82 @@
+# benchmark_frame_decode.py
+# Compares webcam-frame preprocessing for BLIP captioning:
+#   current: full JPEG decode -> BGR2RGB -> PIL Image -> BlipProcessor (resize + normalize)
+#   fast:    reduced-scale JPEG decode -> one resize -> normalize into a preallocated batch
+#
+#   python benchmark_frame_decode.py --iterations 50 --batch 8
+#
+# Only the image processor config is loaded, not the captioning model.
+import argparse
+import time
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BlipImageProcessor
+
+from preprocess_video import FrameBatcher, decode_jpeg_to_size, reduced_decode_scale
+
+MODEL_NAME = "Salesforce/blip-image-captioning-base"
+RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+
+
+def synthetic_jpeg(width: int, height: int, quality: int = 85) -> bytes:
+    # smooth gradients plus a little noise, so it compresses like a camera frame
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)), (x + y) / 2], axis=-1)
+    img = np.clip(img + rng.normal(0, 8, img.shape), 0, 255).astype(np.uint8)
+    cv2.circle(img, (width // 3, height // 2), min(width, height) // 5, (30, 200, 90), -1)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    assert ok
+    return buf.tobytes()
+
+
+def current_path(jpegs, image_processor) -> torch.Tensor:
+    images = []
+    for b in jpegs:
+        img = cv2.imdecode(np.frombuffer(b, np.uint8), cv2.IMREAD_COLOR)
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        images.append(Image.fromarray(img).convert("RGB"))
+    return image_processor(images=images, return_tensors="pt").pixel_values
+
+
+def fast_path(jpegs, batcher: FrameBatcher) -> torch.Tensor:
+    return batcher([decode_jpeg_to_size(b, batcher.frame_size) for b in jpegs])
+
+
+def time_per_frame(fn, iterations: int, frames: int) -> float:
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / (iterations * frames) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame preprocessing paths")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=8, help="frames per preprocessing call")
+    args = parser.parse_args()
+
+    image_processor = BlipImageProcessor.from_pretrained(MODEL_NAME)
+    frame_size = (image_processor.size["height"], image_processor.size["width"])
+    batcher = FrameBatcher(frame_size, image_processor.image_mean, image_processor.image_std, max_batch=args.batch)
+
+    print(f"model input {frame_size[1]}x{frame_size[0]}, batch {args.batch}, {args.iterations} iterations")
+    # sources too small for a reduced decode (e.g. 640x480 into 384x384) only gain from the single resize
+    print(f"{'source':>10} {'scale':>6} {'current ms/frame':>17} {'fast ms/frame':>14} {'speedup':>8} {'mean |diff|':>12}")
+    for width, height in RESOLUTIONS:
+        jpegs = [synthetic_jpeg(width, height)] * args.batch
+        current = time_per_frame(lambda: current_path(jpegs, image_processor), args.iterations, args.batch)
+        fast = time_per_frame(lambda: fast_path(jpegs, batcher), args.iterations, args.batch)
+        # different resamplers, so small differences in normalized pixel values are expected
+        diff = (current_path(jpegs, image_processor) - fast_path(jpegs, batcher)).abs().mean().item()
+        factor, _ = reduced_decode_scale((width, height), frame_size)
+        print(f"{width}x{height:<5} {'1/' + str(factor):>6} {current:>17.2f} {fast:>14.2f} {current / fast:>7.1f}x {diff:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,9 @@ import asyncio
 from typing import List
 
 class ModelInterface:
-    def __init__(self, model_name="google/flan-t5-base", device="cpu"):
+    def __init__(self, model_name="google/flan-t5-base", device="cpu", max_batch_size=16):
         self.device = device
+        self.max_batch_size = max_batch_size
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(self.device)
         # adjust generation kwargs as needed
@@ -30,8 +31,11 @@ class ModelInterface:
         return text
 
     async def generate_many(self, prompts: List[str]):
-        # default loop (not optimized batching)
+        # padded batches of up to max_batch_size prompts per generate call
         results = []
-        for p in prompts:
-            results.append(await self.generate(p))
+        for i in range(0, len(prompts), self.max_batch_size):
+            chunk = prompts[i:i + self.max_batch_size]
+            enc = self.tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=1024).to(self.device)
+            out = self.model.generate(**enc, **self.gen_kwargs)
+            results.extend(self.tokenizer.batch_decode(out, skip_special_tokens=True))
         return results
\ No newline at end of file
@@ -4,9 +4,28 @@ import torch
 import numpy as np
 import soundfile as sf
 import asyncio
-from typing import Optional
+from typing import List, Optional
 from transformers import Wav2Vec2Processor, Wav2Vec2ForCTC
 
+def load_audio_file(path: str, target_sr: int = 16000) -> np.ndarray:
+    # plain decode + resample, no model needed (safe to call from worker processes)
+    data, sr = sf.read(path, dtype='float32')
+    if sr != target_sr:
+        import scipy.signal
+        data = scipy.signal.resample(data.astype(np.float64), int(len(data) * target_sr / sr)).astype(np.float32)
+    return data
+
+def load_audio_ffmpeg(path: str, target_sr: int = 16000) -> Optional[np.ndarray]:
+    # any container ffmpeg reads (m4a, mp4, mkv, ...) -> mono float32; None if there is no audio stream
+    import ffmpeg
+    streams = ffmpeg.probe(path).get("streams", [])
+    if not any(st.get("codec_type") == "audio" for st in streams):
+        return None
+    out, _ = (ffmpeg.input(path)
+              .output("pipe:", format="f32le", acodec="pcm_f32le", ac=1, ar=target_sr)
+              .run(capture_stdout=True, capture_stderr=True))
+    return np.frombuffer(out, np.float32)
+
 class AudioProcessor:
     def __init__(self, target_sr=16000, model_name="facebook/wav2vec2-base-960h"):
         self.target_sr = target_sr
@@ -16,10 +35,7 @@ class AudioProcessor:
 
     async def extract_audio_from_file(self, path: str):
         # read via soundfile
-        data, sr = sf.read(path, dtype='float32')
-        if sr != self.target_sr:
-            import scipy.signal
-            data = scipy.signal.resample(data.astype(np.float64), int(len(data) * self.target_sr / sr)).astype(np.float32)
+        data = load_audio_file(path, self.target_sr)
         return torch.tensor(data, dtype=torch.float32)
 
     async def from_wav_bytes(self, wav_bytes: bytes):
@@ -37,4 +53,12 @@ class AudioProcessor:
         logits = self.model(input_values).logits
         predicted_ids = torch.argmax(logits, dim=-1)
         transcription = self.processor.batch_decode(predicted_ids)[0]
-        return transcription
\ No newline at end of file
+        return transcription
+
+    async def transcribe_batch(self, tensors: List[torch.Tensor]) -> List[str]:
+        # one forward pass over several clips, zero-padded to the longest
+        audios = [t.cpu().numpy() for t in tensors]
+        input_values = self.processor(audios, return_tensors="pt", sampling_rate=self.target_sr, padding=True).input_values.to(self.device)
+        logits = self.model(input_values).logits
+        predicted_ids = torch.argmax(logits, dim=-1)
+        return self.processor.batch_decode(predicted_ids)
\ No newline at end of file
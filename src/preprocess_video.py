@@ -1,54 +1,152 @@
 # preprocess_video.py
 import cv2
 import numpy as np
-from PIL import Image
 import torch
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import asyncio
-from typing import List
+from typing import List, Optional, Tuple
+
+# libjpeg can scale by 1/2, 1/4 or 1/8 inside the IDCT, much cheaper than a full decode + resize
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# a reduced decode may come out slightly under frame_size (720p at 1/2 is 640x360 for a 384 target);
+# upscaling that little costs less detail than it saves in decode time
+MAX_REDUCED_UPSCALE = 1.1
+# SOF markers carry the image dimensions (DHT/JPG/DAC share the range but are not frames)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def read_frames(path: str, target_fps=1, max_frames=8) -> List[np.ndarray]:
+    # plain decode + subsample to target_fps, no model needed (safe to call from worker processes)
+    cap = cv2.VideoCapture(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    step = max(1, int(round(fps / target_fps)))
+    frames = []
+    idx = 0
+    while True and len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if idx % step == 0:
+            # convert to RGB
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frames.append(frame)
+        idx += 1
+    cap.release()
+    return frames
+
+def jpeg_dimensions(b: bytes) -> Optional[Tuple[int, int]]:
+    # (width, height) from the JPEG frame header, without decoding any pixels
+    if b[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 <= len(b):
+        if b[i] != 0xFF:
+            return None
+        marker = b[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # standalone markers, no length
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(b[i + 5:i + 7], "big")
+            width = int.from_bytes(b[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(b[i + 2:i + 4], "big")
+    return None
+
+def resize_frame(frame: np.ndarray, frame_size) -> np.ndarray:
+    # frame_size is (height, width)
+    h, w = frame_size
+    if frame.shape[:2] == (h, w):
+        return frame
+    shrinking = frame.shape[0] > h or frame.shape[1] > w
+    return cv2.resize(frame, (w, h), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+def reduced_decode_scale(dims: Optional[Tuple[int, int]], frame_size) -> Tuple[int, int]:
+    # (factor, imdecode flag) for the smallest libjpeg scale that covers frame_size, within MAX_REDUCED_UPSCALE
+    h, w = frame_size
+    if dims is not None:
+        for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+            if dims[0] // factor * MAX_REDUCED_UPSCALE >= w and dims[1] // factor * MAX_REDUCED_UPSCALE >= h:
+                return factor, reduced_flag
+    return 1, cv2.IMREAD_COLOR
+
+def decode_jpeg_to_size(b: bytes, frame_size) -> np.ndarray:
+    # decode at a reduced libjpeg scale where possible, then resize once; returns RGB
+    _, flag = reduced_decode_scale(jpeg_dimensions(b), frame_size)
+    img = cv2.imdecode(np.frombuffer(b, np.uint8), flag)  # BGR
+    if img is None:
+        raise ValueError("could not decode JPEG frame")
+    # colour conversion after the resize so it only touches model-sized pixels
+    return cv2.cvtColor(resize_frame(img, frame_size), cv2.COLOR_BGR2RGB)
+
+class FrameBatcher:
+    # packs RGB uint8 frames into a preallocated, normalized NCHW float batch
+    def __init__(self, frame_size, mean, std, max_batch=16, device="cpu"):
+        self.frame_size = tuple(frame_size)
+        self.device = device
+        # (x / 255 - mean) / std folded into one multiply-add per channel
+        std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.scale = 1.0 / (255.0 * std)
+        self.bias = -torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1) / std
+        self._allocate(max_batch)
+
+    def _allocate(self, n):
+        h, w = self.frame_size
+        self.buffer = torch.empty((n, 3, h, w), dtype=torch.float32, pin_memory=self.device == "cuda")
+        # marks when the last async host->device copy out of the buffer has finished
+        self._copy_done = None
+
+    def __call__(self, frames: List[np.ndarray]) -> torch.Tensor:
+        # on CPU the result is a view of the shared buffer, valid until the next call;
+        # on CUDA it is a device tensor and the buffer is only refilled once its copy has landed
+        if self._copy_done is not None:
+            self._copy_done.synchronize()
+            self._copy_done = None
+        if len(frames) > self.buffer.shape[0]:
+            self._allocate(len(frames))
+        out = self.buffer[:len(frames)]
+        for i, frame in enumerate(frames):
+            out[i].copy_(torch.from_numpy(resize_frame(frame, self.frame_size)).permute(2, 0, 1))
+        out.mul_(self.scale).add_(self.bias)
+        if self.device != "cuda":
+            return out
+        batch = out.to(self.device, non_blocking=True)
+        self._copy_done = torch.cuda.Event()
+        self._copy_done.record()
+        return batch
 
 class VideoProcessor:
-    def __init__(self, target_fps=1, frame_size=(224,224)):
+    # caption_frames / caption_single_frame share one FrameBatcher buffer: they are safe to
+    # call from coroutines on one event loop (they never await mid-batch), but must not be
+    # run concurrently from several threads
+    def __init__(self, target_fps=1, frame_size=None):
         self.target_fps = target_fps
-        self.frame_size = frame_size
         # BLIP image captioning
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
         self.blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base").to(self.device)
+        # frames go straight to BLIP's input size (height, width) unless overridden
+        image_processor = self.blip_processor.image_processor
+        self.frame_size = tuple(frame_size) if frame_size else (image_processor.size["height"], image_processor.size["width"])
+        self.batcher = FrameBatcher(self.frame_size, image_processor.image_mean, image_processor.image_std, device=self.device)
 
     async def extract_frames_from_file(self, path: str, max_frames=8) -> List[np.ndarray]:
-        cap = cv2.VideoCapture(path)
-        fps = cap.get(cv2.CAP_PROP_FPS) or 25
-        step = max(1, int(round(fps / self.target_fps)))
-        frames = []
-        idx = 0
-        while True and len(frames) < max_frames:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if idx % step == 0:
-                # convert to RGB
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frames.append(frame)
-            idx += 1
-        cap.release()
-        return frames
-
-    def frame_from_jpeg_bytes(self, b: bytes):
-        arr = np.frombuffer(b, np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_COLOR)  # BGR
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        return img
+        return read_frames(path, self.target_fps, max_frames)
+
+    def model_frame_from_jpeg_bytes(self, b: bytes):
+        # fast path: reduced-scale decode straight to frame_size (RGB uint8)
+        return decode_jpeg_to_size(b, self.frame_size)
 
     async def caption_single_frame(self, frame: np.ndarray) -> str:
-        image = Image.fromarray(frame).convert("RGB")
-        inputs = self.blip_processor(images=image, return_tensors="pt").to(self.device)
-        out_ids = self.blip_model.generate(**inputs, max_new_tokens=32)
-        caption = self.blip_processor.decode(out_ids[0], skip_special_tokens=True)
-        return caption
+        return (await self.caption_frames([frame]))[0]
 
-    async def caption_frames(self, frames):
+    async def caption_frames(self, frames, batch_size=16):
+        # caption in batches: one BLIP generate call per batch_size frames
         captions = []
-        for f in frames:
-            captions.append(await self.caption_single_frame(f))
+        for i in range(0, len(frames), batch_size):
+            pixel_values = self.batcher(frames[i:i + batch_size])
+            out_ids = self.blip_model.generate(pixel_values=pixel_values, max_new_tokens=32)
+            captions.extend(self.blip_processor.batch_decode(out_ids, skip_special_tokens=True))
         return captions
\ No newline at end of file
@@ -28,7 +28,7 @@ BATCH_WAIT_MS = 50
 
 # Instantiate processors & model interface (singletons)
 audio_proc = AudioProcessor(target_sr=16000)
-video_proc = VideoProcessor(target_fps=1, frame_size=(224, 224))
+video_proc = VideoProcessor(target_fps=1)
 model_if = ModelInterface(device="cuda" if torch.cuda.is_available() else "cpu")
 
 # Simple in-memory session store for websocket streams
@@ -139,7 +139,7 @@ async def ws_endpoint(ws: WebSocket):
             elif typ == "frame":
                 b64 = data["data"]
                 raw = base64.b64decode(b64)
-                frame = video_proc.frame_from_jpeg_bytes(raw)
+                frame = video_proc.model_frame_from_jpeg_bytes(raw)
                 sessions[sid]["frames"].append(frame)
                 sessions[sid]["last_activity"] = time.time()
                 # caption last frame
@@ -149,9 +149,7 @@ async def ws_endpoint(ws: WebSocket):
                 # Build final prompt
                 audio_tensor = torch.cat(sessions[sid]["audio_chunks"]) if sessions[sid]["audio_chunks"] else None
                 transcript = await audio_proc.transcribe_tensor(audio_tensor) if audio_tensor is not None else ""
-                captions = []
-                for f in sessions[sid]["frames"]:
-                    captions.append(await video_proc.caption_single_frame(f))
+                captions = await video_proc.caption_frames(sessions[sid]["frames"])
                 prompt = model_if.compose_prompt(task=data.get("task","summarize"), transcript=transcript, captions=captions)
                 # run model (sync path via model_if)
                 out = await model_if.generate(prompt)